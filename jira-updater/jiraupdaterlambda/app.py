@@ -3,14 +3,19 @@
 import json
 import os
 import base64
+import time
 
 # Import your helper modules
-from ppt_extractor import process_pptx
-from jira_updater import update_jira_from_extracted_data
+from ppt_extractor import process_pptx, filter_extracted_data, render_pptx_images, decode_base64_to_pptx, work_path
+from jira_updater import update_jira_from_extracted_data, plan_jira_from_extracted_data
 from openai_call import openAICall
+from sync_state import get_sync_state_store, hash_payload, hash_file
+from checkpoints import get_checkpoint_store
+import metrics
 
 
 def lambda_handler(event, context):
+    checkpoints = job_lock = None
     try:
 
         if "body" in event:
@@ -33,35 +38,132 @@ def lambda_handler(event, context):
         # 1) Retrieve the PPT base64 from the event
         ppt_base64 = body.get("pptBase64")
         epic_key = body.get("epic_key")
+
+        # Plan mode: diff the deck tables against the epic, no rendering, no LLM, no write.
+        if body.get("plan"):
+            extracted_data = process_pptx(ppt_base64, render_images=False)
+            sync_state = {} if body.get("full_sync") else get_sync_state_store().load(epic_key)
+            plan = plan_jira_from_extracted_data(
+                extracted_data, epic_key, os.environ.get('JIRA_BASE_URL'), os.environ.get('JIRA_TOKEN'), sync_state
+            )
+            return {
+                "statusCode": 200,
+                "body": json.dumps({
+                    "message": "Jira sync plan computed",
+                    "details": plan
+                })
+            }
         
-        output_folder = "/tmp/output"
+        output_folder = work_path("output")
         if not os.path.exists(output_folder):
             os.makedirs(output_folder)
         
-        # 2) Extract from PPT -> JSON and save png file to be show in JIRA
-        extracted_data = process_pptx(ppt_base64)
+        # Each stage writes a checkpoint: a retry of the same job (same deck) resumes at the first incomplete stage.
+        # The caller's job_id is hashed too, it is used as a path by the checkpoint store.
+        if body.get("job_id"):
+            job_id = hash_payload([body["job_id"]])
+        else:
+            job_id = hash_payload([epic_key, ppt_base64, bool(body.get("full_sync"))])
+        checkpoints = get_checkpoint_store()
+        sync_store = get_sync_state_store()
+
+        # A gateway retry may arrive while the first attempt is still running: only one may write to Jira.
+        job_lock = checkpoints.acquire(job_id)
+        if job_lock is None:
+            return {
+                "statusCode": 409,
+                "body": json.dumps({"error": "This job is already running, retry later"})
+            }
+
+        # Checkpoints are only trusted if the epic was not synced by another job since they were written.
+        stored_state = sync_store.load(epic_key)
+        state_version = hash_payload(stored_state)
+        sync_state = {} if body.get("full_sync") else stored_state
+        meta = checkpoints.load(job_id, "meta")
+        if meta is None or checkpoints.is_stale(meta, state_version):
+            if meta is not None:
+                print(f"Discarding outdated checkpoints of job {job_id}")
+            checkpoints.clear(job_id)
+
+        # 2) Extract from PPT -> JSON
+        extraction = checkpoints.load(job_id, "extracted")
+        if extraction is None:
+            with metrics.timer("stage_extract_seconds"):
+                extracted_data = process_pptx(ppt_base64, render_images=False)
+            source_hashes = extracted_data.pop("source_hashes", {})
+
+            # Only process the features whose rows or referenced slides changed since the last sync
+            changed = [num for num, h in source_hashes.items() if sync_state.get(num, {}).get("source_hash") != h]
+            if not changed:
+                return {
+                    "statusCode": 200,
+                    "body": json.dumps({
+                        "message": "Jira already up to date",
+                        "details": {"unchanged": len(source_hashes)}
+                    })
+                }
+            extraction = {
+                "extracted_data": filter_extracted_data(extracted_data, changed),
+                "source_hashes": source_hashes
+            }
+            meta = {"epic_key": epic_key, "created_at": time.time(), "state_version": state_version}
+            checkpoints.save(job_id, "meta", meta)
+            checkpoints.save(job_id, "extracted", extraction)
+        else:
+            print(f"Resuming job {job_id} after extraction")
+            decode_base64_to_pptx(ppt_base64, work_path("presentation.pptx"))
+        extracted_data = extraction["extracted_data"]
+        source_hashes = extraction["source_hashes"]
+
+        # Save png file to be show in JIRA (rendered again only if the files of the manifest are not in
+        # this output folder, e.g. the retry runs on another server worker)
+        manifest = checkpoints.load(job_id, "artifacts")
+        if manifest is None or not all(
+            os.path.exists(os.path.join(output_folder, filename))
+            and hash_file(os.path.join(output_folder, filename)) == file_hash
+            for filename, file_hash in manifest.items()
+        ):
+            with metrics.timer("stage_render_seconds"):
+                image_paths = render_pptx_images(extracted_data["impacts_architecture_association"])
+            manifest = {os.path.basename(path): hash_file(path) for path in image_paths}
+            checkpoints.save(job_id, "artifacts", manifest)
+
+        transformed_data = checkpoints.load(job_id, "llm")
+        if transformed_data is None:
+            # Assume openAICall is defined elsewhere and returns the raw output string.
+            with metrics.timer("stage_llm_seconds"):
+                raw_output = openAICall(extracted_data)
+
+            # Split into lines and remove markdown code fences if present.
+            lines = raw_output.strip().splitlines()
+            if lines and lines[0].startswith("```"):
+                lines = lines[1:]
+            if lines and lines[-1].startswith("```"):
+                lines = lines[:-1]
+
+            clean_output = "\n".join(lines)
 
-        # Assume openAICall is defined elsewhere and returns the raw output string.
-        raw_output = openAICall(extracted_data)
+            try:
+                transformed_data = json.loads(clean_output)
+            except json.JSONDecodeError as e:
+                print("Error decoding JSON:", e)
+                transformed_data = []
 
-        # Split into lines and remove markdown code fences if present.
-        lines = raw_output.strip().splitlines()
-        if lines and lines[0].startswith("```"):
-            lines = lines[1:]
-        if lines and lines[-1].startswith("```"):
-            lines = lines[:-1]
+            # 1 on parse failure: the mean of this metric is the parse-failure rate.
+            metrics.observe("openai_parse_failed", 0 if transformed_data else 1)
 
-        clean_output = "\n".join(lines)
+            # Structured output wraps the features in an object.
+            if isinstance(transformed_data, dict) and "features" in transformed_data:
+                transformed_data = transformed_data["features"]
 
-        try:
-            transformed_data = json.loads(clean_output)
-        except json.JSONDecodeError as e:
-            print("Error decoding JSON:", e)
-            transformed_data = []
+            # Ensure the transformed_data is a list.
+            if not isinstance(transformed_data, list):
+                transformed_data = [transformed_data]
 
-        # Ensure the transformed_data is a list.
-        if not isinstance(transformed_data, list):
-            transformed_data = [transformed_data]
+            # An unparseable or incomplete answer is not checkpointed so the retry asks again.
+            answered = {feature.get("Numéro") for feature in transformed_data if isinstance(feature, dict)}
+            if all(func.get("Numéro") in answered for func in extracted_data["functionalities"]):
+                checkpoints.save(job_id, "llm", transformed_data)
 
 
         # 3) Gather Jira environment variables
@@ -69,10 +171,52 @@ def lambda_handler(event, context):
         jira_token = os.environ.get('JIRA_TOKEN')
 
         
-        # 4) Update Jira
-        result = update_jira_from_extracted_data(transformed_data, epic_key, jira_base_url, jira_token)
+        # 4) Update Jira, checkpointing every write so a resume never creates an issue twice
+        write_results = checkpoints.load(job_id, "jira") or {}
+        with metrics.timer("stage_jira_seconds"):
+            result = update_jira_from_extracted_data(
+                transformed_data, epic_key, jira_base_url, jira_token, sync_state,
+                write_results=write_results,
+                on_write=lambda: checkpoints.save(job_id, "jira", write_results),
+                output_folder=output_folder,
+                attachments=list(manifest)
+            )
+
+        # 5) Persist the sync state: features that failed keep their old source hash and are retried next run.
+        # A feature is only done once every image rendered for it has been uploaded.
+        done = []
+        for num in result["synced"]:
+            attachments = sync_state[num].get("attachments", {})
+            uploaded = all(
+                attachments.get(filename) == file_hash
+                for filename, file_hash in manifest.items() if filename.startswith(f"{num}_")
+            )
+            if num in source_hashes and uploaded:
+                sync_state[num]["source_hash"] = source_hashes[num]
+                done.append(num)
+        for num in list(sync_state):
+            if num not in source_hashes:
+                del sync_state[num]
+        sync_store.save(epic_key, sync_state)
+
+        # Some Jira writes failed: keep the checkpoints so the retry resumes at the Jira stage.
+        incomplete = [func.get("Numéro") for func in extracted_data["functionalities"] if func.get("Numéro") not in done]
+        if incomplete:
+            # This job changed the sync state itself: its checkpoints stay valid for the retry.
+            meta["state_version"] = hash_payload(sync_state)
+            checkpoints.save(job_id, "meta", meta)
+            return {
+                "statusCode": 502,
+                "body": json.dumps({
+                    "error": "Jira partially updated, retry the request to resume",
+                    "incomplete": incomplete,
+                    "details": result
+                })
+            }
+        checkpoints.clear(job_id)
+        checkpoints.discard_epic_jobs(epic_key, job_id)
 
-        # 5) Return success
+        # 6) Return success
         return {
             "statusCode": 200,
             "body": json.dumps({
@@ -84,4 +228,7 @@ def lambda_handler(event, context):
         return {
             "statusCode": 500,
             "body": json.dumps({"error": str(e)})
-        }
\ No newline at end of file
+        }
+    finally:
+        if job_lock:
+            checkpoints.release(job_lock)
\ No newline at end of file
@@ -0,0 +1,145 @@
+import fcntl
+import os
+import shutil
+import time
+
+from stores import build_store, read_json, write_json_atomic
+
+
+class CheckpointStore:
+    """
+    Stores the output of each pipeline stage of a job so a retry can resume
+    at the first incomplete stage.
+
+    A job is identified by its job_id (given in the request or derived from the deck hash),
+    a stage by its name ("extracted", "artifacts", "llm", "jira"). The "meta" stage records the
+    epic, the creation time and the version of the epic sync state the job started from.
+    Backends only have to implement load, save, clear, jobs, acquire and release.
+    """
+
+    def load(self, job_id, stage):
+        raise NotImplementedError
+
+    def save(self, job_id, stage, data):
+        raise NotImplementedError
+
+    def clear(self, job_id):
+        raise NotImplementedError
+
+    def jobs(self):
+        """
+        Returns the ids of the jobs that have checkpoints.
+        """
+        raise NotImplementedError
+
+    def is_stale(self, meta, state_version=None):
+        """
+        Tells whether the checkpoints of a job must be discarded: older than CHECKPOINT_TTL_SECONDS
+        (one day by default), or started from another version of the epic sync state,
+        i.e. the epic was synced by another job since.
+        """
+        ttl = int(os.environ.get("CHECKPOINT_TTL_SECONDS", 86400))
+        if time.time() - meta.get("created_at", 0) > ttl:
+            return True
+        return state_version is not None and meta.get("state_version") != state_version
+
+    def discard_epic_jobs(self, epic_key, finished_job_id):
+        """
+        Called when a job of the epic succeeded: clears the pending checkpoints of the other
+        jobs of the epic, which were computed from an outdated state, and the expired ones.
+        Jobs currently running are left alone.
+        """
+        for job_id in self.jobs():
+            if job_id == finished_job_id:
+                continue
+            meta = self.load(job_id, "meta")
+            if meta is not None and meta.get("epic_key") != epic_key and not self.is_stale(meta):
+                continue
+            handle = self.acquire(job_id)
+            if handle is None:
+                continue
+            try:
+                self.clear(job_id)
+            finally:
+                self.release(handle)
+
+    def acquire(self, job_id):
+        """
+        Takes the exclusive lock of a job without waiting.
+        Returns a handle for release, or None when the job is already running.
+        """
+        raise NotImplementedError
+
+    def release(self, handle):
+        raise NotImplementedError
+
+
+class FileCheckpointStore(CheckpointStore):
+    """
+    Keeps one directory per job and one JSON file per stage.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, job_id, stage):
+        return os.path.join(self.directory, job_id, f"{stage}.json")
+
+    def load(self, job_id, stage):
+        return read_json(self._path(job_id, stage))
+
+    def save(self, job_id, stage, data):
+        path = self._path(job_id, stage)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_json_atomic(path, data)
+
+    def clear(self, job_id):
+        shutil.rmtree(os.path.join(self.directory, job_id), ignore_errors=True)
+
+    def jobs(self):
+        return [name for name in os.listdir(self.directory) if os.path.isdir(os.path.join(self.directory, name))]
+
+    def _lock_path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.lock")
+
+    def acquire(self, job_id):
+        path = self._lock_path(job_id)
+        for _ in range(3):
+            lock_file = open(path, "a")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock_file.close()
+                return None
+            # The job holding the lock may have removed the file in the meantime (see release):
+            # the lock is then on a stale file, take it again on the current one.
+            if os.path.exists(path) and os.stat(path).st_ino == os.fstat(lock_file.fileno()).st_ino:
+                return job_id, lock_file
+            lock_file.close()
+        return None
+
+    def release(self, handle):
+        job_id, lock_file = handle
+        # Lock files of finished jobs are removed, the ones of jobs to resume are kept.
+        if not os.path.isdir(os.path.join(self.directory, job_id)):
+            try:
+                os.remove(self._lock_path(job_id))
+            except FileNotFoundError:
+                pass
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        lock_file.close()
+
+
+# Backend name -> (store class, default location).
+CHECKPOINT_BACKENDS = {
+    "file": (FileCheckpointStore, "/tmp/checkpoints"),
+}
+
+
+def get_checkpoint_store():
+    """
+    Builds the store selected by the CHECKPOINT_BACKEND environment variable
+    ("file" by default). CHECKPOINT_PATH overrides the backend location.
+    """
+    return build_store(CHECKPOINT_BACKENDS, "CHECKPOINT", "file")
@@ -2,7 +2,164 @@ import requests
 import json
 import os
 
-def update_jira_from_extracted_data(extracted_data, epic_key, jira_base_url, jira_token):
+from sync_state import hash_payload, hash_file
+
+
+# Sessions are kept across invocations (warm Lambda container or server worker)
+# so the connections to Jira are reused.
+_sessions = {}
+
+
+def _jira_session(jira_token):
+    """
+    Returns a requests session carrying the Jira bearer token and JSON content type.
+    """
+    if ("json", jira_token) not in _sessions:
+        session = requests.Session()
+        session.headers.update({
+            "Authorization": f"Bearer {jira_token}",
+            "Content-Type": "application/json"
+        })
+        _sessions[("json", jira_token)] = session
+    return _sessions[("json", jira_token)]
+
+
+def _jira_upload_session(jira_token):
+    """
+    Returns a requests session with only the headers needed for file uploads.
+    """
+    if ("upload", jira_token) not in _sessions:
+        session = requests.Session()
+        session.headers.update({
+            "Authorization": f"Bearer {jira_token}",
+            "X-Atlassian-Token": "no-check"
+        })
+        _sessions[("upload", jira_token)] = session
+    return _sessions[("upload", jira_token)]
+
+
+def _search_epic_issues(session, jira_base_url, epic_key, fields="summary"):
+    """
+    Returns the issues linked to the epic (raw "issues" list of the Jira search API).
+    """
+    jql = f'"Epic Link" = "{epic_key}"' #AND labels = "Train"
+    search_url = f"{jira_base_url}/rest/api/2/search"
+    params = {"jql": jql, "fields": fields}
+    response = session.get(search_url, params=params)
+    return response.json().get("issues", [])
+
+
+def _deck_values(scopes, column):
+    """
+    Returns the sorted values of a comma-separated column over the scope rows of a feature.
+    """
+    values = set()
+    for scope in scopes:
+        for line in scope.get(column, "").splitlines():
+            values.update(item.strip() for item in line.split(",") if item.strip())
+    return sorted(values)
+
+
+def _jira_values(issue, field):
+    """
+    Returns the sorted values of a Jira multi-select field ([{"value": ...}, ...]).
+    """
+    return sorted(option.get("value") for option in issue.get("fields", {}).get(field) or [])
+
+
+def _match_issue_key(num, numero, record, existing_by_num):
+    """
+    Returns the key of the epic issue a feature maps to, or num when there is none.
+
+    The "ID Jira" of the deck comes first. Without it, the issue recorded in the sync state
+    is used, then an issue whose summary starts with "<Numéro> - ": it may have been created
+    by an attempt whose response was lost (timeout, 5xx), and must not be created twice.
+    """
+    if num in existing_by_num:
+        return num
+    if not num and record.get("issue_key") in existing_by_num:
+        return record["issue_key"]
+    for key, issue in existing_by_num.items():
+        if (issue.get("fields", {}).get("summary") or "").startswith(f"{numero} - "):
+            return key
+    return num
+
+
+def plan_jira_from_extracted_data(extracted_data, epic_key, jira_base_url, jira_token, sync_state=None):
+    """
+    Computes what a sync would do to the epic without writing anything to Jira.
+
+    It works on the raw output of process_pptx (no rendering, no OpenAI call) and
+    only issues the epic search request. Features are matched the same way as in
+    update_jira_from_extracted_data: by their "ID Jira", then by the issue key of the
+    sync state, then by summary (see _match_issue_key).
+
+    Like the sync, a feature whose source hash (deck rows and referenced slides) is the one
+    recorded in the sync state is unchanged, whatever its Jira fields: the sync skips it.
+    Any other feature is an update when it maps to an issue of the epic, a create otherwise.
+    For updates, the summary ("<Numéro> - <Nom>") and the Applications / Scopes of the scopes
+    table that differ from Jira are listed under "current" (the description comes from the LLM).
+
+    Args:
+        extracted_data (dict): Data returned by process_pptx (uses "functionalities", "scopes"
+            and "source_hashes").
+        epic_key (str): The Jira epic key.
+        jira_base_url (str): The base URL of your Jira instance.
+        jira_token (str): API token for Jira.
+        sync_state (dict, optional): Sync state of the epic loaded from a SyncStateStore.
+
+    Returns:
+        dict: Lists of "create", "update", "unchanged" features and the "orphans"
+        issue keys that the (disabled) delete step would remove.
+    """
+    session = _jira_session(jira_token)
+    existing_issues = _search_epic_issues(
+        session, jira_base_url, epic_key, fields="summary,customfield_13600,customfield_14506"
+    )
+    existing_by_num = {issue["key"]: issue for issue in existing_issues}
+
+    plan = {"create": [], "update": [], "unchanged": [], "orphans": []}
+    input_numbers = set()
+
+    for feature in extracted_data.get("functionalities", []):
+        numero = feature.get("Numéro")
+        record = (sync_state or {}).get(numero, {})
+        num = _match_issue_key(feature.get("ID Jira", "").strip(), numero, record, existing_by_num)
+        summary = f"{numero} - {feature.get('Nom')}"
+        scopes = [scope for scope in extracted_data.get("scopes", []) if scope.get("Numéro") == numero]
+        entry = {
+            "Numéro": numero,
+            "jiraID": num,
+            "summary": summary,
+            "customfield_13600": _deck_values(scopes, "Applications"),
+            "customfield_14506": _deck_values(scopes, "Scopes")
+        }
+
+        if num in existing_by_num:
+            input_numbers.add(num)
+
+        source_hash = extracted_data.get("source_hashes", {}).get(numero)
+        if source_hash is not None and record.get("source_hash") == source_hash:
+            plan["unchanged"].append(entry)
+        elif num in existing_by_num:
+            issue = existing_by_num[num]
+            current = {
+                "summary": issue.get("fields", {}).get("summary"),
+                "customfield_13600": _jira_values(issue, "customfield_13600"),
+                "customfield_14506": _jira_values(issue, "customfield_14506")
+            }
+            changes = {field: value for field, value in current.items() if value != entry[field]}
+            if changes:
+                entry["current"] = changes
+            plan["update"].append(entry)
+        else:
+            plan["create"].append(entry)
+
+    plan["orphans"] = [key for key in existing_by_num if key not in input_numbers]
+    return plan
+
+
+def update_jira_from_extracted_data(extracted_data, epic_key, jira_base_url, jira_token, sync_state=None, write_results=None, on_write=None, output_folder="/tmp/output", attachments=None):
     """
     Updates Jira issues based on the extracted data (a list of features).
     
@@ -21,9 +178,22 @@ def update_jira_from_extracted_data(extracted_data, epic_key, jira_base_url, jir
         jira_base_url (str): The base URL of your Jira instance.
         jira_token (str): API token for Jira.
         project_key (str): The Jira project key.
+        sync_state (dict, optional): Sync state of the epic loaded from a SyncStateStore.
+            When given, features are matched to the issue key recorded at the previous run,
+            issues whose generated fields did not change are not rewritten, attachments
+            whose content did not change are not re-uploaded, and the state is updated in place.
+        write_results (dict, optional): Per-issue write results of the current job, keyed by "Numéro".
+            Filled in place after each Jira write; when resuming a job, the features and
+            attachments it already lists are not written again (no duplicated creates).
+        on_write (callable, optional): Called without arguments after each successful Jira write,
+            typically to checkpoint write_results.
+        output_folder (str): Folder holding the PNG images to attach.
+        attachments (list, optional): Names of the PNG files of output_folder rendered for this run.
+            Only these are attached; all the PNG files of the folder when not given.
         
     Returns:
-        dict: A dictionary with counts for created, updated, deleted issues and total issues in the epic after updates.
+        dict: A dictionary with counts for created, updated, skipped, deleted issues, total issues
+        in the epic after updates and the list of "Numéro" that were fully synced.
     """
 
 
@@ -76,12 +246,8 @@ def update_jira_from_extracted_data(extracted_data, epic_key, jira_base_url, jir
                 print(f"Deleted existing attachment '{file_name}' (id {att_id}) from issue {issue_key}")
         # Now upload the new attachment using a separate session.
         upload_url = f"{jira_base_url}/rest/api/2/issue/{issue_key}/attachments"
-        upload_session = requests.Session()
         # Set only the necessary headers for file upload.
-        upload_session.headers.update({
-            "Authorization": f"Bearer {jira_token}",
-            "X-Atlassian-Token": "no-check"
-        })
+        upload_session = _jira_upload_session(jira_token)
         with open(file_path, "rb") as f:
             files = {"file": f}
             resp = upload_session.post(upload_url, files=files)
@@ -139,18 +305,10 @@ def update_jira_from_extracted_data(extracted_data, epic_key, jira_base_url, jir
         resp.raise_for_status()
         return {"deleted": issue_key}
     
-    session = requests.Session()
-    session.headers.update({
-        "Authorization": f"Bearer {jira_token}",
-        "Content-Type": "application/json"
-    })
+    session = _jira_session(jira_token)
 
     # Retrieve existing issues in the epic that have label "Train"
-    jql = f'"Epic Link" = "{epic_key}"' #AND labels = "Train"
-    search_url = f"{jira_base_url}/rest/api/2/search"
-    params = {"jql": jql, "fields": "summary"}
-    response = session.get(search_url, params=params)
-    existing_issues = response.json().get("issues", [])
+    existing_issues = _search_epic_issues(session, jira_base_url, epic_key)
     
     # Map existing issues by their key (which should correspond to extracted_data "jiraID")
     existing_by_num = {}
@@ -163,10 +321,23 @@ def update_jira_from_extracted_data(extracted_data, epic_key, jira_base_url, jir
 
     created_count = 0
     updated_count = 0
+    skipped_count = 0
     deleted_count = 0
 
         # We'll build a mapping: extracted jiraID -> {"jira_issue_key": ..., "Numero": ...}
     features_issue_map = {}
+    # "Numéro" whose issue was written (or already up to date) in this run.
+    synced = []
+
+    def _record_write(numero, issue_key, attachment=None):
+        if write_results is None:
+            return
+        result = write_results.setdefault(numero, {"issue_key": issue_key, "attachments": {}})
+        if attachment:
+            filename, file_hash = attachment
+            result["attachments"][filename] = file_hash
+        if on_write:
+            on_write()
 
     """
     # Delete Jira issues that are not present in the extracted input.
@@ -184,11 +355,34 @@ def update_jira_from_extracted_data(extracted_data, epic_key, jira_base_url, jir
         description = feature.get("Description")
         applications = feature.get("customfield_13600", "")
         scopes = feature.get("customfield_14506", "")
-    
 
-        if num in existing_by_num:
+        record = sync_state.setdefault(numero, {}) if sync_state is not None else {}
+        # An issue created by a previous run may not have its key in the deck yet.
+        num = _match_issue_key(num, numero, record, existing_by_num)
+        fields_hash = hash_payload([summary, description, applications, scopes])
+        written = write_results.get(numero) if write_results is not None else None
+
+        if written:
+            # Already written by an interrupted attempt of this job: never create it twice,
+            # even if the Jira search does not return the new issue yet.
+            num = written["issue_key"]
+            print(f"Jira {num} already written by this job.")
+            record.update({"issue_key": num, "fields_hash": fields_hash})
+            features_issue_map[num] = numero
+            synced.append(numero)
+            skipped_count += 1
+        elif num in existing_by_num and record.get("issue_key") == num and record.get("fields_hash") == fields_hash:
+            print(f"Jira {num} already up to date.")
+            features_issue_map[num] = numero
+            synced.append(numero)
+            skipped_count += 1
+            _record_write(numero, num)
+        elif num in existing_by_num:
             try:
                 _update_issue(session, jira_base_url, num, summary, description, applications, scopes, numero)
+                record.update({"issue_key": num, "fields_hash": fields_hash})
+                synced.append(numero)
+                _record_write(numero, num)
             except Exception as e:
                     print(f"Error updating {num} issue. {e}")
             features_issue_map[num] = numero
@@ -198,6 +392,9 @@ def update_jira_from_extracted_data(extracted_data, epic_key, jira_base_url, jir
                 created_resp = _create_issue(session, jira_base_url, summary, description, applications, scopes, numero)
                 new_key = created_resp.get("key")
                 features_issue_map[new_key] = numero
+                record.update({"issue_key": new_key, "fields_hash": fields_hash, "attachments": {}})
+                synced.append(numero)
+                _record_write(numero, new_key)
                 created_count += 1
             except Exception as e:
                 print(f"Error creating {numero} issue. {e}")
@@ -208,20 +405,37 @@ def update_jira_from_extracted_data(extracted_data, epic_key, jira_base_url, jir
     
     # Now upload attachments (images) to each Jira issue.
     for k, v in features_issue_map.items():
+        attachments_state = sync_state.get(v, {}).setdefault("attachments", {}) if sync_state is not None else {}
+        # Attachments uploaded by an interrupted attempt of this job count as already synced.
+        if write_results is not None and v in write_results:
+            attachments_state.update(write_results[v]["attachments"])
         # List all .png files in the output folder that start with the feature's "Numéro"
-        for filename in os.listdir("/tmp/output"):
-            if filename.lower().endswith(".png") and filename.startswith(v):
-                file_path = os.path.join("/tmp/output", filename)
+        # Only the images of this run: the folder may keep images of earlier decks (server workers).
+        filenames = attachments if attachments is not None else os.listdir(output_folder)
+        for filename in filenames:
+            if filename.lower().endswith(".png") and filename.startswith(f"{v}_"):
+                file_path = os.path.join(output_folder, filename)
+                file_hash = hash_file(file_path)
+                if attachments_state.get(filename) == file_hash:
+                    print(f"Attachment {filename} of issue {k} unchanged, skipping upload")
+                    continue
                 try:
                     upload_attachment(session, jira_base_url, k, file_path)
+                    attachments_state[filename] = file_hash
+                    _record_write(v, k, (filename, file_hash))
                     print(f"Uploaded attachment {filename} to issue {k}")
                 except Exception as e:
                     print(f"Failed to upload {filename} to issue {k}: {e}")
+                    # Keep the feature out of the synced list so the next run retries it.
+                    if v in synced:
+                        synced.remove(v)
     
                     
     return {
         "created": created_count,
         "updated": updated_count,
+        "skipped": skipped_count,
         "deleted": deleted_count,
-        "total_in_epic_after": total_after
+        "total_in_epic_after": total_after,
+        "synced": synced
     }
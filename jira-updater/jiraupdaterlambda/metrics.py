@@ -0,0 +1,61 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+_lock = threading.Lock()
+_counters = {}
+_observations = {}
+
+
+def increment(name, amount=1):
+    """
+    Adds amount to the counter name.
+    """
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def observe(name, value):
+    """
+    Records a value (token count, latency...) and prints it as a JSON log line,
+    so it can also be aggregated from the Lambda logs.
+    """
+    with _lock:
+        stats = _observations.setdefault(name, {"count": 0, "sum": 0, "max": 0})
+        stats["count"] += 1
+        stats["sum"] += value
+        stats["max"] = max(stats["max"], value)
+    print(json.dumps({"metric": name, "value": value}))
+
+
+def reset():
+    """
+    Clears everything recorded so far (used by forked server workers).
+    """
+    with _lock:
+        _counters.clear()
+        _observations.clear()
+
+
+def snapshot():
+    """
+    Returns the counters and observations recorded since the process started.
+    """
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "observations": {name: dict(stats) for name, stats in _observations.items()}
+        }
+
+
+@contextmanager
+def timer(name):
+    """
+    Observes the duration in seconds of the with block under name.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start)
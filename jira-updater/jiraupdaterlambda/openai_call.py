@@ -1,8 +1,74 @@
 from openai import OpenAI
 import os
+import json
+
+import metrics
 
 client = OpenAI(api_key=os.environ.get("OPENAI_API"))
 
+# Columns sent to the model, in the order of each encoded row.
+COMPACT_COLUMNS = [
+    "Numéro", "ID Jira", "Nom", "Hypothèses de bénéfices", "Critères d’acceptance",
+    "Scopes", "Applications", "Referents", "Impacts", "Architectures"
+]
+
+# Output format enforced by the model (structured outputs): the answer is always parseable JSON.
+FEATURES_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "features": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "Numéro": {"type": "string"},
+                    "jiraID": {"type": "string"},
+                    "summary": {"type": "string"},
+                    "Description": {"type": "string"},
+                    "customfield_13600": {"type": "array", "items": {"type": "string"}},
+                    "customfield_14506": {"type": "array", "items": {"type": "string"}}
+                },
+                "required": ["Numéro", "jiraID", "summary", "Description", "customfield_13600", "customfield_14506"],
+                "additionalProperties": False
+            }
+        }
+    },
+    "required": ["features"],
+    "additionalProperties": False
+}
+
+
+def encode_compact_input(extracted_data):
+    """
+    Encodes the extracted data as compact JSON: the column names once, then one row per feature
+    holding only the fields used by the prompt. The scopes of a feature are merged into its row
+    and the raw "Impacts / Architecture" text is replaced by the parsed slide numbers.
+    """
+    association = {a.get("Numéro"): a for a in extracted_data.get("impacts_architecture_association", [])}
+    rows = []
+    for func in extracted_data.get("functionalities", []):
+        num = func.get("Numéro")
+        scopes = [scope for scope in extracted_data.get("scopes", []) if scope.get("Numéro") == num]
+        assoc = association.get(num, {})
+        rows.append([
+            num,
+            func.get("ID Jira", ""),
+            func.get("Nom", ""),
+            func.get("Hypothèses de bénéfices", ""),
+            func.get("Critères d’acceptance", ""),
+            "\n".join(scope.get("Scopes", "") for scope in scopes),
+            "\n".join(scope.get("Applications", "") for scope in scopes),
+            "\n".join(scope.get("Referents", "") for scope in scopes),
+            assoc.get("Impacts:", []),
+            assoc.get("Architectures:", [])
+        ])
+    compact = {
+        "visa": extracted_data.get("config", {}).get("VISA", ""),
+        "columns": COMPACT_COLUMNS,
+        "rows": rows
+    }
+    return json.dumps(compact, ensure_ascii=False, separators=(",", ":"))
+
 
 def openAICall(userInput):
     response = client.responses.create(
@@ -13,7 +79,7 @@ def openAICall(userInput):
         "content": [
             {
             "type": "input_text",
-            "text": "You are provided with extracted data from a PowerPoint presentation. The data consists of three parts:\n\n1. **config** - configuration, where it contain the visa url link:\n- **VISA**\n\n2. **functionalities** – a list of feature dictionaries, where each feature contains the following fields:  \n   - **Numéro**  \n   - **ID Jira**  \n   - **Nom**  \n   - **Hypothèses de bénéfices**  \n   - **Critères d’acceptance**  \n   - **Sizing SI (PI)**  \n\n3. **scopes** – a list of scope dictionaries, where each dictionary contains:  \n   - **Numéro**  \n   - **Scopes**  \n   - **Applications**  \n   - **Referents**  \n   - **Impacts / Architecture**\n\nThe **Impacts / Architecture** field in each scope entry is a text string in this format:  \nImpacts: 10, 11  \nArchitectures: 12, 13\n\nwhere the numbers represent slide numbers that should be converted into PNG images. Image references will be used in the final Jira issue description.\n\nYour task is to produce a JSON output that lists, for each feature (matched by its **Numéro**), all modifications required for Jira update. For each feature, include:\n- The **Numéro** and **Nom** (which will serve as the Jira summary).\n- A fully formatted **Description** field that follows this template:\n\n{panel:title=Objectif de la demande // Request goal|titleBGColor=#7768c7}\n * Besoin : <Insert what you understand of the need of the functionnality>\n{panel}\n{panel:title=Hypothèses de bénéfice // Profit hypothesis|titleBGColor=#7768c7}\n * [Insert each Hypothèses de bénéfices]\n{panel}\n{panel:title=Critères d'acceptance  // Acceptance criteria|titleBGColor=#7768c7}\n * [Insert each Critères d’acceptance]\n{panel}\n{panel:title=Images Architecture|titleBGColor=#7768c7}\n [For each slide number from the corresponding scope’s “Architectures” (e.g., for slide 12, insert: !<Numéro>_architecture_slide12.png|thumbnail!)]\n{panel}\n{panel:title=Images Impact|titleBGColor=#7768c7}\n [For each slide number from the corresponding scope’s “Impacts” (e.g., for slide 10, insert: !<Numéro>_impact_slide10.png|thumbnail!)]\n{panel}\n{panel:title=Lien vers la documentation // Link to the libraries|titleBGColor=#7768c7}\n[Insert VISA link here]\n{panel}\n{panel:title=Référents du Train // ART's Referents|titleBGColor=#7768c7}\nEpic Owner : [Insert Epic Owner]\nRelais RTE: [Insert RTE]\nRessource U&P: [Insert U&P]\n{panel}\n\n\nIn your output JSON, for each feature, replace the placeholders with actual values from the extracted data:\n- Use the feature’s **Hypothèses de bénéfices** and **Critères d’acceptance** fields in the description.\n- For the images section, use the **Numéro** of the feature along with the slide numbers parsed from the **Impacts / Architecture** field of the matching scope entry (matching by **Numéro**). For example, if a feature with **Numéro** \"E69F02\" has impacts on slides 10 and 11, include:\n  - !E69F02_impact_slide10.png!\n  - !E69F02_impact_slide11.png!\n- Do the same for the Architectures images.\n\nFinally, output the complete list of modifications (each feature with its summary and the fully formatted description) in JSON format. Assume that the current Jira data is not available; just produce the modifications based solely on the extracted data.\n\ncustomfield_13600 is for Applications field\ncustomfield_14506 is for Scopes field\n\n\nYour final JSON output should have an array of features where each feature is represented as:\n{\n  \"Numéro\": \"<feature number>\",\n  \"jiraID\": \"<ID Jira field>\",\n  \"summary\": \"<Nom field>\",\n  \"Description\": \"<fully formatted description with all placeholders replaced>\",\n  \"customfield_13600\": \"<list of Applications>\",\n  \"customfield_14506\": \"<list of Scopes>\",\n}"
+            "text": "You are provided with extracted data from a PowerPoint presentation, encoded as a compact JSON object with three parts:\n\n1. **visa** – the VISA url link.\n\n2. **columns** – the column names, given once:  \n   - **Numéro**  \n   - **ID Jira**  \n   - **Nom**  \n   - **Hypothèses de bénéfices**  \n   - **Critères d’acceptance**  \n   - **Scopes**  \n   - **Applications**  \n   - **Referents**  \n   - **Impacts**  \n   - **Architectures**\n\n3. **rows** – one array per feature, with the values in the order of **columns**.\n\nThe **Impacts** and **Architectures** values are lists of slide numbers that are converted into PNG images. Image references will be used in the final Jira issue description.\n\nYour task is to produce a JSON output that lists, for each feature (matched by its **Numéro**), all modifications required for Jira update. For each feature, include:\n- The **Numéro** and **Nom** (which will serve as the Jira summary).\n- A fully formatted **Description** field that follows this template:\n\n{panel:title=Objectif de la demande // Request goal|titleBGColor=#7768c7}\n * Besoin : <Insert what you understand of the need of the functionnality>\n{panel}\n{panel:title=Hypothèses de bénéfice // Profit hypothesis|titleBGColor=#7768c7}\n * [Insert each Hypothèses de bénéfices]\n{panel}\n{panel:title=Critères d'acceptance  // Acceptance criteria|titleBGColor=#7768c7}\n * [Insert each Critères d’acceptance]\n{panel}\n{panel:title=Images Architecture|titleBGColor=#7768c7}\n [For each slide number from the corresponding scope’s “Architectures” (e.g., for slide 12, insert: !<Numéro>_architecture_slide12.png|thumbnail!)]\n{panel}\n{panel:title=Images Impact|titleBGColor=#7768c7}\n [For each slide number from the corresponding scope’s “Impacts” (e.g., for slide 10, insert: !<Numéro>_impact_slide10.png|thumbnail!)]\n{panel}\n{panel:title=Lien vers la documentation // Link to the libraries|titleBGColor=#7768c7}\n[Insert VISA link here]\n{panel}\n{panel:title=Référents du Train // ART's Referents|titleBGColor=#7768c7}\nEpic Owner : [Insert Epic Owner]\nRelais RTE: [Insert RTE]\nRessource U&P: [Insert U&P]\n{panel}\n\n\nIn your output JSON, for each feature, replace the placeholders with actual values from the extracted data:\n- Use the feature’s **Hypothèses de bénéfices** and **Critères d’acceptance** fields in the description.\n- For the images section, use the **Numéro** of the feature along with the slide numbers of its **Impacts** and **Architectures**. For example, if a feature with **Numéro** \"E69F02\" has impacts on slides 10 and 11, include:\n  - !E69F02_impact_slide10.png!\n  - !E69F02_impact_slide11.png!\n- Do the same for the Architectures images.\n\nFinally, output the complete list of modifications (each feature with its summary and the fully formatted description) in JSON format. Assume that the current Jira data is not available; just produce the modifications based solely on the extracted data.\n\ncustomfield_13600 is for Applications field\ncustomfield_14506 is for Scopes field\n\n\nYour final JSON output is an object with a **features** array where each feature is represented as:\n{\n  \"Numéro\": \"<feature number>\",\n  \"jiraID\": \"<ID Jira field>\",\n  \"summary\": \"<Nom field>\",\n  \"Description\": \"<fully formatted description with all placeholders replaced>\",\n  \"customfield_13600\": [\"<each Application>\"],\n  \"customfield_14506\": [\"<each Scope>\"]\n}"
             }
         ]
         },
@@ -22,14 +88,17 @@ def openAICall(userInput):
         "content": [
             {
             "type": "input_text",
-            "text": f"{userInput}"
+            "text": encode_compact_input(userInput)
             }
         ]
         }
     ],
     text={
         "format": {
-        "type": "text"
+        "type": "json_schema",
+        "name": "jira_features",
+        "schema": FEATURES_SCHEMA,
+        "strict": True
         }
     },
     reasoning={},
@@ -40,5 +109,15 @@ def openAICall(userInput):
     stream=False,
     store=False
     )
-    return response.output[0].content[0].text
+    if response.usage:
+        metrics.observe("openai_input_tokens", response.usage.input_tokens)
+        metrics.observe("openai_output_tokens", response.usage.output_tokens)
+    metrics.increment("openai_calls")
+    content = response.output[0].content[0]
+    # With a strict json_schema the model may refuse instead of answering: the caller
+    # gets an empty output, counted as a parse failure, and the retry asks again.
+    if content.type == "refusal":
+        print("OpenAI refused to answer:", content.refusal)
+        return ""
+    return content.text
 
@@ -7,10 +7,35 @@ import subprocess
 import json
 from PIL import Image
 import re
+import hashlib
+import resource
 
 import subprocess
 import os
 
+from sync_state import hash_payload
+
+def work_path(*parts):
+    """
+    Returns a path in the working directory (WORK_DIR environment variable, /tmp by default).
+    The server mode gives each worker its own WORK_DIR so concurrent jobs do not share files.
+    """
+    return os.path.join(os.environ.get("WORK_DIR", "/tmp"), *parts)
+
+def limit_converter_memory():
+    """
+    Runs in the LibreOffice / poppler child processes before they start.
+    They get their own address space limit, CONVERTER_MEMORY_MB, instead of the limit
+    of the Python worker (WORKER_MEMORY_MB in server mode), which they keep otherwise.
+    """
+    memory_mb = int(os.environ.get("CONVERTER_MEMORY_MB", 0))
+    if memory_mb:
+        _, hard = resource.getrlimit(resource.RLIMIT_AS)
+        limit = memory_mb * 1024 * 1024
+        if hard != resource.RLIM_INFINITY:
+            limit = min(limit, hard)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
 def convert_pdf_to_images(pdf_path, output_dir):
     # Ensure the output directory exists.
     os.makedirs(output_dir, exist_ok=True)
@@ -21,11 +46,11 @@ def convert_pdf_to_images(pdf_path, output_dir):
 
     # Convert PDF pages to PNG images using pdftoppm.
     command = ["pdftoppm", pdf_path, output_prefix, "-png"]
-    subprocess.run(command, check=True)
+    subprocess.run(command, check=True, preexec_fn=limit_converter_memory)
 
     # Get PDF info using pdfinfo to extract the number of pages.
     info_command = ["pdfinfo", pdf_path]
-    result = subprocess.run(info_command, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    result = subprocess.run(info_command, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, preexec_fn=limit_converter_memory)
 
     # Parse the output to find the line that starts with "Pages:" and extract the page count.
     page_count = None
@@ -84,10 +109,14 @@ def convert_pptx_to_pdf(pptx_path, pdf_path):
     """
     try:
         output_dir = os.path.dirname(pdf_path)
+        # Keep the LibreOffice profile in the working directory: it is created once and reused
+        # by the next conversions, and concurrent workers do not lock each other's profile.
+        profile_url = "file://" + work_path("libreoffice_profile")
         # Run LibreOffice in headless mode to convert the PPTX to PDF.
         subprocess.run(
-            ['libreoffice', '--headless', '--convert-to', 'pdf', pptx_path, '--outdir', output_dir],
-            check=True
+            ['libreoffice', f'-env:UserInstallation={profile_url}', '--headless', '--convert-to', 'pdf', pptx_path, '--outdir', output_dir],
+            check=True,
+            preexec_fn=limit_converter_memory
         )
         # LibreOffice names the PDF with the same base name as the PPTX.
         generated_pdf = os.path.join(output_dir, os.path.splitext(os.path.basename(pptx_path))[0] + ".pdf")
@@ -96,6 +125,8 @@ def convert_pptx_to_pdf(pptx_path, pdf_path):
         print(f"✅ PowerPoint successfull converted to PDF: {pdf_path}")
     except Exception as e:
         print(f"❌ Error converting PowerPoint to PDF: {e}")
+        # Without the PDF no image can be attached: let the run fail so it is retried.
+        raise
 
 def extract_pdf_pages_to_png(pdf_path, slide_numbers, output_folder):
     """
@@ -244,7 +275,7 @@ def associate_impacts_architecture(functionalities, scopes):
         })
     return association
 
-def process_pptx(base64_pptx):
+def process_pptx(base64_pptx, render_images=True):
     """
     Process a base64 PowerPoint:
       - Reads configuration from the first slide (slide numbers for functionalities and scopes, and the VISA link).
@@ -254,15 +285,40 @@ def process_pptx(base64_pptx):
       - Uses the impacts_architecture_association list to extract PNG images from the PDF.
         Each PNG is saved with a file name of the feature including an indication if it's impact or architecture.
       - Structures all extracted information in a JSON object.
+
+    When render_images is False, only the table extraction runs: LibreOffice and
+    pdftoppm are skipped and no PNG is written (used by the plan mode and by the
+    incremental sync, which renders later with render_pptx_images).
     """
 
-    pptx_path = os.path.join("/tmp/", "presentation.pptx")
-    pdf_path = os.path.join("/tmp/", "presentation.pdf")
-    json_file = os.path.join("/tmp/", "extracted_data.json")
+    pptx_path = work_path("presentation.pptx")
+    json_file = work_path("extracted_data.json")
 
     decode_base64_to_pptx(base64_pptx, pptx_path)
+    extracted_data = extract_pptx_data(pptx_path)
+
+    if render_images:
+        render_pptx_images(extracted_data["impacts_architecture_association"])
+
+    return extracted_data
+
+def render_pptx_images(association):
+    """
+    Converts the PPTX decoded by process_pptx to a PDF and saves the PNG images
+    of the given impacts_architecture_association entries in the output folder.
+    Returns the list of saved PNG paths.
+    """
+    pptx_path = work_path("presentation.pptx")
+    pdf_path = work_path("presentation.pdf")
     convert_pptx_to_pdf(pptx_path, pdf_path)
+    return render_association_images(pdf_path, association, work_path("output"))
 
+def extract_pptx_data(pptx_path):
+    """
+    Reads the configuration slide and the functionalities / scopes tables of a .pptx file.
+    Returns the extracted data dictionary (config, functionalities, scopes,
+    impacts_architecture_association and source_hashes) without rendering any slide.
+    """
     prs = Presentation(pptx_path)
     config_slide = prs.slides[0]
     config_map = parse_configuration_slide(config_slide)
@@ -304,27 +360,86 @@ def process_pptx(base64_pptx):
     # Create association table: for each functionality 'Numéro', associate its impacts and architectures
     extracted_data["impacts_architecture_association"] = associate_impacts_architecture(functionalities_data, scopes_data)
 
-    # ---- New Part: Extract PNG images using the association list ----
+    # Fingerprint each feature so a re-sync can skip the unchanged ones
+    extracted_data["source_hashes"] = compute_source_hashes(prs, extracted_data)
+
+    return extracted_data
+
+def hash_slide(slide):
+    """
+    Returns a hash of the slide XML and of the parts it embeds (pictures, charts...).
+    """
+    digest = hashlib.sha256(slide.part.blob)
+    for rel in slide.part.rels.values():
+        if not rel.is_external:
+            digest.update(rel.target_part.blob)
+    return digest.hexdigest()
+
+def compute_source_hashes(prs, extracted_data):
+    """
+    Computes, for each functionality 'Numéro', a hash of everything its Jira issue is built from:
+    its functionalities and scopes rows, the VISA link and the slides referenced
+    in its 'Impacts / Architecture' (rendered as attachments).
+    Returns a dictionary mapping 'Numéro' to the hash.
+    """
+    slide_hashes = {}
+    source_hashes = {}
+    for assoc in extracted_data["impacts_architecture_association"]:
+        num = assoc.get("Numéro")
+        referenced_slides = sorted(set(assoc.get("Impacts:", []) + assoc.get("Architectures:", [])))
+        for slide_num in referenced_slides:
+            if slide_num not in slide_hashes and 1 <= slide_num <= len(prs.slides):
+                slide_hashes[slide_num] = hash_slide(prs.slides[slide_num - 1])
+        source_hashes[num] = hash_payload({
+            "functionalities": [f for f in extracted_data["functionalities"] if f.get("Numéro") == num],
+            "scopes": [scope for scope in extracted_data["scopes"] if scope.get("Numéro") == num],
+            "visa": extracted_data["config"].get("VISA"),
+            "impacts": assoc.get("Impacts:", []),
+            "architectures": assoc.get("Architectures:", []),
+            "slides": [slide_hashes.get(n) for n in referenced_slides]
+        })
+    return source_hashes
+
+def filter_extracted_data(extracted_data, numeros):
+    """
+    Returns a copy of the extracted data restricted to the functionalities whose 'Numéro' is in numeros.
+    """
+    numeros = set(numeros)
+    filtered = dict(extracted_data)
+    for key in ["functionalities", "scopes", "impacts_architecture_association"]:
+        filtered[key] = [row for row in extracted_data.get(key, []) if row.get("Numéro") in numeros]
+    return filtered
+
+def render_association_images(pdf_path, association, output_folder):
+    """
+    Uses the impacts_architecture_association list to extract PNG images from the PDF.
+    Each PNG is saved with a file name of the feature including an indication if it's impact or architecture.
+    Returns the list of saved PNG paths.
+    """
+    saved_paths = []
     try:
         #pages = convert_from_path(pdf_path=pdf_path, poppler_path="/usr/bin/pdftoppm")
-        pages = convert_pdf_to_images(pdf_path, "/tmp/output")
+        pages = convert_pdf_to_images(pdf_path, output_folder)
 
-        for assoc in extracted_data["impacts_architecture_association"]:
+        for assoc in association:
             feature_num = assoc.get("Numéro")
             # Process Impact images: the numbers here represent slide numbers to convert to PNG.
             for slide_num in assoc.get("Impacts:", []):
                 if 1 <= slide_num <= len(pages):
-                    image_path = os.path.join("/tmp/output", f"{feature_num}_impact_slide{slide_num}.png")
+                    image_path = os.path.join(output_folder, f"{feature_num}_impact_slide{slide_num}.png")
                     pages[slide_num - 1].save(image_path, "PNG")
+                    saved_paths.append(image_path)
                     print(f"Saved impact PNG: {image_path}")
             # Process Architecture images.
             for slide_num in assoc.get("Architectures:", []):
                 if 1 <= slide_num <= len(pages):
-                    image_path = os.path.join("/tmp/output", f"{feature_num}_architecture_slide{slide_num}.png")
+                    image_path = os.path.join(output_folder, f"{feature_num}_architecture_slide{slide_num}.png")
                     pages[slide_num - 1].save(image_path, "PNG")
+                    saved_paths.append(image_path)
                     print(f"Saved architecture PNG: {image_path}")
 
     except Exception as e:
         print("Error:", e)
+        raise
 
-    return extracted_data
+    return saved_paths
@@ -0,0 +1,201 @@
+# server.py
+#
+# Runs the same pipeline as app.lambda_handler as a long-running HTTP service:
+#   PUT /updatejira  - same payload as the API Gateway route, processed by a worker pool
+#                      (workers keep imports and HTTP sessions warm; LibreOffice is still started per conversion)
+#   GET /metrics     - queue depth, worker count and stage latencies (JSON)
+#
+# Configuration (environment variables):
+#   SERVER_HOST, SERVER_PORT - listening address (0.0.0.0:8080 by default)
+#   WORKERS                  - number of worker processes (2 by default)
+#   QUEUE_SIZE               - jobs allowed to wait for a worker before answering 429 (WORKERS by default)
+#   WORKER_MEMORY_MB         - address space limit of each Python worker, 0 for no limit (default)
+#   CONVERTER_MEMORY_MB      - address space limit of each LibreOffice / pdftoppm process started by
+#                              a worker (see ppt_extractor.limit_converter_memory), WORKER_MEMORY_MB
+#                              when not set. LibreOffice reserves a lot of address space: allow 2048 or more.
+
+import json
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import metrics
+
+
+def _init_worker(memory_mb):
+    """
+    Runs once in each worker process: applies the memory limit, gives the worker
+    its own working directory and imports the pipeline so it stays warm between jobs.
+    """
+    # A worker may inherit the metrics of the process it was started from, start from scratch.
+    metrics.reset()
+    if memory_mb:
+        import resource
+        # Soft limit only, so the converters can be given their own limit (see ppt_extractor.limit_converter_memory).
+        _, hard = resource.getrlimit(resource.RLIMIT_AS)
+        resource.setrlimit(resource.RLIMIT_AS, (memory_mb * 1024 * 1024, hard))
+    os.environ["WORK_DIR"] = os.path.join(os.environ.get("WORK_DIR", "/tmp"), f"worker-{os.getpid()}")
+    os.makedirs(os.environ["WORK_DIR"], exist_ok=True)
+    import app  # noqa: F401
+
+
+def _ping():
+    return os.getpid()
+
+
+def _run_job(raw_body):
+    """
+    Runs the pipeline in a worker. Returns the Lambda-style response and the metrics of the worker.
+    """
+    import app
+    response = app.lambda_handler({"body": raw_body}, None)
+    return os.getpid(), response, metrics.snapshot()
+
+
+class WorkerPool:
+    """
+    Process pool with bounded admission: at most workers + queue_size jobs are accepted at once.
+    """
+
+    def __init__(self, workers, queue_size, memory_mb):
+        self.workers = workers
+        self.capacity = workers + queue_size
+        self.memory_mb = memory_mb
+        self.in_flight = 0
+        self.worker_metrics = {}
+        self._lock = threading.Lock()
+        self._executor = self._new_executor()
+
+    def _new_executor(self):
+        # Workers are started from a forkserver, never forked from a request thread
+        # that may hold a lock (metrics, logging...) at fork time.
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("forkserver"),
+            initializer=_init_worker,
+            initargs=(self.memory_mb,)
+        )
+
+    def warm_up(self):
+        """
+        Starts every worker (and imports the pipeline in it) before the first request.
+        """
+        futures = [self._executor.submit(_ping) for _ in range(self.workers)]
+        for future in futures:
+            future.result()
+
+    def try_acquire(self):
+        with self._lock:
+            if self.in_flight >= self.capacity:
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def run(self, raw_body):
+        """
+        Runs a job previously admitted with try_acquire and returns its Lambda-style response.
+        """
+        try:
+            executor = self._executor
+            pid, response, worker_snapshot = executor.submit(_run_job, raw_body).result()
+            with self._lock:
+                self.worker_metrics[pid] = worker_snapshot
+            return response
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for exceeding its memory limit): replace the pool.
+            metrics.increment("worker_crashes")
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = self._new_executor()
+            return {"statusCode": 503, "body": json.dumps({"error": "Worker crashed, retry the request"})}
+        finally:
+            self.release()
+
+    def snapshot(self):
+        """
+        Returns the pool state and the metrics of the server and of every worker, merged.
+        """
+        with self._lock:
+            snapshots = [metrics.snapshot()] + list(self.worker_metrics.values())
+            in_flight = self.in_flight
+        merged = {"counters": {}, "observations": {}}
+        for snap in snapshots:
+            for name, value in snap["counters"].items():
+                merged["counters"][name] = merged["counters"].get(name, 0) + value
+            for name, stats in snap["observations"].items():
+                total = merged["observations"].setdefault(name, {"count": 0, "sum": 0, "max": 0})
+                total["count"] += stats["count"]
+                total["sum"] += stats["sum"]
+                total["max"] = max(total["max"], stats["max"])
+        for stats in merged["observations"].values():
+            stats["avg"] = stats["sum"] / stats["count"] if stats["count"] else 0
+        return {
+            "workers": self.workers,
+            "capacity": self.capacity,
+            "in_flight": in_flight,
+            "queue_depth": max(0, in_flight - self.workers),
+            **merged
+        }
+
+
+def make_handler(pool):
+    class Handler(BaseHTTPRequestHandler):
+
+        def _send(self, status_code, body):
+            data = body.encode("utf-8")
+            self.send_response(status_code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path.rstrip("/") == "/metrics":
+                self._send(200, json.dumps(pool.snapshot()))
+            else:
+                self._send(404, json.dumps({"error": "Not found"}))
+
+        def do_PUT(self):
+            if self.path.rstrip("/") != "/updatejira":
+                self._send(404, json.dumps({"error": "Not found"}))
+                return
+            if not pool.try_acquire():
+                metrics.increment("rejected_requests")
+                self._send(429, json.dumps({"error": "Too many requests, all workers are busy"}))
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                raw_body = self.rfile.read(length).decode("utf-8")
+            except Exception:
+                pool.release()
+                raise
+            with metrics.timer("request_seconds"):
+                response = pool.run(raw_body)
+            self._send(response["statusCode"], response["body"])
+
+    return Handler
+
+
+def main():
+    workers = int(os.environ.get("WORKERS", 2))
+    queue_size = int(os.environ.get("QUEUE_SIZE", workers))
+    memory_mb = int(os.environ.get("WORKER_MEMORY_MB", 0))
+    host = os.environ.get("SERVER_HOST", "0.0.0.0")
+    port = int(os.environ.get("SERVER_PORT", 8080))
+
+    pool = WorkerPool(workers, queue_size, memory_mb)
+    pool.warm_up()
+    server = ThreadingHTTPServer((host, port), make_handler(pool))
+    print(f"Listening on {host}:{port} with {workers} workers (queue size {queue_size})")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+import json
+import os
+import tempfile
+
+
+def write_json_atomic(path, data, **dump_kwargs):
+    """
+    Writes data as JSON to path through a temporary file in the same directory,
+    so a crash never leaves a truncated file and concurrent writers never share a temporary file.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, **dump_kwargs)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def read_json(path, default=None):
+    """
+    Returns the JSON content of path, or default when the file does not exist.
+    """
+    if not os.path.exists(path):
+        return default
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def build_store(backends, prefix, default_backend):
+    """
+    Builds a store from a registry mapping backend names to (store class, default location).
+
+    The backend is selected by the <prefix>_BACKEND environment variable and its location
+    overridden by <prefix>_PATH (e.g. SYNC_STATE_BACKEND / SYNC_STATE_PATH).
+    """
+    backend = os.environ.get(f"{prefix}_BACKEND", default_backend)
+    if backend not in backends:
+        raise ValueError(f"Unknown {prefix.lower().replace('_', ' ')} backend '{backend}'")
+    store_class, default_path = backends[backend]
+    return store_class(os.environ.get(f"{prefix}_PATH", default_path))
@@ -0,0 +1,138 @@
+import hashlib
+import json
+import os
+import sqlite3
+
+from stores import build_store, read_json, write_json_atomic
+
+
+def hash_payload(payload):
+    """
+    Returns a stable sha256 hex digest of a JSON-serializable payload.
+    """
+    data = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def hash_file(file_path):
+    """
+    Returns the sha256 hex digest of a file content.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class SyncStateStore:
+    """
+    Stores the sync state of an epic between runs.
+
+    The state of an epic is a dictionary keyed by feature "Numéro":
+        {
+            "E69F02": {
+                "issue_key": "PROJECT-123",
+                "source_hash": "<hash of the deck rows and referenced slides>",
+                "fields_hash": "<hash of the fields written to Jira>",
+                "attachments": {"E69F02_impact_slide10.png": "<file hash>"}
+            }
+        }
+    Backends only have to implement load and save.
+    """
+
+    def load(self, epic_key):
+        raise NotImplementedError
+
+    def save(self, epic_key, state):
+        raise NotImplementedError
+
+
+class SQLiteSyncStateStore(SyncStateStore):
+    """
+    Keeps every epic in a single SQLite database, one row per feature.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sync_state ("
+                " epic_key TEXT NOT NULL,"
+                " numero TEXT NOT NULL,"
+                " issue_key TEXT,"
+                " source_hash TEXT,"
+                " fields_hash TEXT,"
+                " attachments TEXT,"
+                " PRIMARY KEY (epic_key, numero))"
+            )
+
+    def load(self, epic_key):
+        with sqlite3.connect(self.db_path) as conn:
+            rows = conn.execute(
+                "SELECT numero, issue_key, source_hash, fields_hash, attachments"
+                " FROM sync_state WHERE epic_key = ?",
+                (epic_key,)
+            ).fetchall()
+        state = {}
+        for numero, issue_key, source_hash, fields_hash, attachments in rows:
+            state[numero] = {
+                "issue_key": issue_key,
+                "source_hash": source_hash,
+                "fields_hash": fields_hash,
+                "attachments": json.loads(attachments) if attachments else {}
+            }
+        return state
+
+    def save(self, epic_key, state):
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("DELETE FROM sync_state WHERE epic_key = ?", (epic_key,))
+            conn.executemany(
+                "INSERT INTO sync_state (epic_key, numero, issue_key, source_hash, fields_hash, attachments)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        epic_key,
+                        numero,
+                        record.get("issue_key"),
+                        record.get("source_hash"),
+                        record.get("fields_hash"),
+                        json.dumps(record.get("attachments", {}))
+                    )
+                    for numero, record in state.items()
+                ]
+            )
+
+
+class FileSyncStateStore(SyncStateStore):
+    """
+    Keeps one JSON file per epic in a directory.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, epic_key):
+        return os.path.join(self.directory, f"{epic_key}.json")
+
+    def load(self, epic_key):
+        return read_json(self._path(epic_key), {})
+
+    def save(self, epic_key, state):
+        write_json_atomic(self._path(epic_key), state, indent=2)
+
+
+# Backend name -> (store class, default location).
+SYNC_STATE_BACKENDS = {
+    "sqlite": (SQLiteSyncStateStore, "/tmp/sync_state.db"),
+    "file": (FileSyncStateStore, "/tmp/sync_state"),
+}
+
+
+def get_sync_state_store():
+    """
+    Builds the store selected by the SYNC_STATE_BACKEND environment variable
+    ("sqlite" by default). SYNC_STATE_PATH overrides the backend location.
+    """
+    return build_store(SYNC_STATE_BACKENDS, "SYNC_STATE", "sqlite")